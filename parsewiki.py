@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import re
+import argparse
+import multiprocessing
 
 
 H4 = re.compile(r"====([\w /]+)====")
@@ -11,6 +14,347 @@ HTTP = re.compile(r" \* (?P<method>POST|GET|PUT|DELETE) (?P<path>.*)")
 ADMIN = re.compile(r" \* Admin only")
 PARAM_END = re.compile(r"^ \* .*")
 URL_PARAMS = re.compile(r"<([\w_-]*)>")
+CACHE_CONTROL = re.compile(r" \* Cache-Control: (?P<value>.*)", re.I)
+STREAM = re.compile(r" \* Stream(?::\s*(?P<format>\S*))?\s*$", re.I)
+STREAM_FORMATS = ['ndjson', 'json']
+# files taken from a directory, the others (READMEs, backups) are skipped
+SPEC_EXTENSIONS = ('.wiki', '.wiki.txt')
+CONCURRENCY = re.compile(r" \* Concurrency:(?P<value>.*)$", re.I)
+CONCURRENCY_VALUE = re.compile(r"\s*(?P<limit>\d+)(?: wait (?P<wait>\d+(?:\.\d+)?)s?)?\s*$", re.I)
+
+
+# code emitted once, before the views, when --metrics is given. Counters are
+# kept per thread and only summed when /metrics is scraped, so the request
+# path never takes a lock. The counters of a finished thread are folded into
+# a retired total, so servers starting a thread per request don't leak them.
+METRICS_CODE = '''
+import bisect
+import threading
+import weakref
+from functools import wraps
+
+from flask import Response
+from werkzeug.exceptions import HTTPException
+
+try:
+    from time import perf_counter as _clock
+except ImportError:
+    from time import time as _clock
+
+METRICS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+                   0.1, 0.5, 1.0, 5.0, 10.0)
+
+_metrics_local = threading.local()
+# weakref to the thread holder -> shard, for the running threads
+_metrics_shards = {}
+_metrics_retired = {}
+_metrics_lock = threading.RLock()
+
+
+def _metrics_stat():
+    n = len(METRICS_BUCKETS) + 1
+    # [status counts, validation buckets, validation sum,
+    #  backend buckets, backend sum, queue buckets, queue sum]
+    return [{}, [0] * n, 0.0, [0] * n, 0.0, [0] * n, 0.0]
+
+
+class _MetricsHolder(object):
+    __slots__ = ('shard', '__weakref__')
+
+
+def _metrics_merge(merged, shard):
+    for endpoint, stat in list(shard.items()):
+        m = merged.get(endpoint)
+        if m is None:
+            m = merged[endpoint] = _metrics_stat()
+        for status, count in list(stat[0].items()):
+            m[0][status] = m[0].get(status, 0) + count
+        for i in range(1, len(stat)):
+            if isinstance(stat[i], list):
+                for j, n in enumerate(stat[i]):
+                    m[i][j] += n
+            else:
+                m[i] += stat[i]
+
+
+def _metrics_retire(ref):
+    with _metrics_lock:
+        shard = _metrics_shards.pop(ref, None)
+        if shard is not None:
+            _metrics_merge(_metrics_retired, shard)
+
+
+def _metrics_shard():
+    try:
+        return _metrics_local.holder.shard
+    except AttributeError:
+        holder = _metrics_local.holder = _MetricsHolder()
+        shard = holder.shard = {}
+        with _metrics_lock:
+            _metrics_shards[weakref.ref(holder, _metrics_retire)] = shard
+        return shard
+
+
+def _metrics_status(rv):
+    if isinstance(rv, tuple) and len(rv) > 1 and isinstance(rv[1], int):
+        return rv[1]
+    return getattr(rv, 'status_code', 200)
+
+
+def _metrics_record(endpoint, status, validation, queue, backend):
+    shard = _metrics_shard()
+    stat = shard.get(endpoint)
+    if stat is None:
+        stat = shard[endpoint] = _metrics_stat()
+    statuses = stat[0]
+    statuses[status] = statuses.get(status, 0) + 1
+    stat[1][bisect.bisect_left(METRICS_BUCKETS, validation)] += 1
+    stat[2] += validation
+    if backend is not None:
+        stat[3][bisect.bisect_left(METRICS_BUCKETS, backend)] += 1
+        stat[4] += backend
+    if queue is not None:
+        stat[5][bisect.bisect_left(METRICS_BUCKETS, queue)] += 1
+        stat[6] += queue
+
+
+def metered(endpoint):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            local = _metrics_local
+            local.queue_start = None
+            local.backend_start = None
+            local.backend_end = None
+            start = _clock()
+            status = 500
+            try:
+                rv = view(*args, **kwargs)
+                status = _metrics_status(rv)
+                return rv
+            except HTTPException as e:
+                status = e.code
+                raise
+            finally:
+                end = _clock()
+                queue_start = local.queue_start
+                backend_start = local.backend_start
+                # views doing more work after internal_call mark its end
+                backend_end = local.backend_end
+                if backend_end is None:
+                    backend_end = end
+                # shed requests record their wait but no backend time
+                backend = None
+                if backend_start is not None:
+                    backend = backend_end - backend_start
+                queue = None
+                if queue_start is not None:
+                    queue = (end if backend_start is None else backend_start) - queue_start
+                validated = queue_start if queue_start is not None else backend_start
+                if validated is None:
+                    validated = end
+                _metrics_record(endpoint, status, validated - start, queue, backend)
+        return wrapper
+    return decorator
+
+
+def _metrics_histogram(lines, name, endpoint, buckets, total):
+    count = 0
+    for le, n in zip(METRICS_BUCKETS + ('+Inf', ), buckets):
+        count += n
+        lines.append('%s_bucket{endpoint="%s",le="%s"} %d' % (name, endpoint, le, count))
+    lines.append('%s_sum{endpoint="%s"} %f' % (name, endpoint, total))
+    lines.append('%s_count{endpoint="%s"} %d' % (name, endpoint, count))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Request counts and latency histograms in the prometheus text format
+    """
+
+    merged = {}
+    with _metrics_lock:
+        _metrics_merge(merged, _metrics_retired)
+        for shard in list(_metrics_shards.values()):
+            _metrics_merge(merged, shard)
+
+    lines = ['# TYPE api_requests_total counter']
+    for endpoint, m in sorted(merged.items()):
+        for status, count in sorted(m[0].items()):
+            lines.append('api_requests_total{endpoint="%s",status="%s"} %d' % (endpoint, status, count))
+    lines.append('# TYPE api_validation_seconds histogram')
+    for endpoint, m in sorted(merged.items()):
+        _metrics_histogram(lines, 'api_validation_seconds', endpoint, m[1], m[2])
+    lines.append('# TYPE api_backend_seconds histogram')
+    for endpoint, m in sorted(merged.items()):
+        _metrics_histogram(lines, 'api_backend_seconds', endpoint, m[3], m[4])
+    lines.append('# TYPE api_queue_seconds histogram')
+    for endpoint, m in sorted(merged.items()):
+        _metrics_histogram(lines, 'api_queue_seconds', endpoint, m[5], m[6])
+
+    return Response('\\n'.join(lines) + '\\n', mimetype='text/plain; version=0.0.4')
+'''
+
+
+# code emitted once, before the views, when --etag is given
+CONDITIONAL_CODE = '''
+from flask import make_response, request
+
+
+def conditional(rv, cache_control=None):
+    """
+    Adds a strong ETag to a successful response, unless internal_call already
+    set one, and answers with a 304 if it matches If-None-Match
+    """
+
+    rv = make_response(rv)
+    if rv.status_code != 200 or rv.is_streamed:
+        return rv
+
+    etag, weak = rv.get_etag()
+    if etag is None or weak:
+        rv.add_etag(overwrite=True)
+    if cache_control:
+        rv.headers['Cache-Control'] = cache_control
+    return rv.make_conditional(request)
+'''
+
+
+# code emitted once, before the views, when any resource is a stream
+STREAM_CODE = '''
+import json
+
+from flask import Response, stream_with_context
+
+
+def stream(items, fmt='ndjson'):
+    """
+    Sends the items returned by internal_call as they come, as newline
+    delimited json or as a json array
+    """
+
+    def ndjson():
+        for item in items:
+            yield json.dumps(item) + '\\n'
+
+    def array():
+        sep = '['
+        for item in items:
+            yield sep + json.dumps(item)
+            sep = ','
+        yield ']' if sep == ',' else '[]'
+
+    if fmt == 'json':
+        return Response(stream_with_context(array()), mimetype='application/json')
+    return Response(stream_with_context(ndjson()), mimetype='application/x-ndjson')
+'''
+
+
+# with --bench, the views are wrapped in a standalone module that drives
+# every route through the flask test client, with a stub internal_call
+BENCH_HEADER = '''#!/usr/bin/env python
+from __future__ import print_function
+
+import sys
+
+from flask import Flask, request, abort
+
+try:
+    from time import perf_counter as _clock
+except ImportError:
+    from time import time as _clock
+
+app = Flask(__name__)
+
+
+def internal_call(path, method, data=None, filters=None):
+    return ''
+'''
+
+BENCH_CODE = '''
+
+def percentile(times, p):
+    return times[min(len(times) - 1, int(len(times) * p))]
+
+
+def run(n=1000, warmup=100):
+    client = app.test_client()
+
+    print('%-50s %7s %10s %10s %10s' % ('route', 'status', 'req/s', 'p50 us', 'p99 us'))
+    for name, method, url, form, query in ROUTES:
+        for i in range(warmup):
+            client.open(url, method=method, data=form, query_string=query).close()
+
+        times = []
+        for i in range(n):
+            start = _clock()
+            rv = client.open(url, method=method, data=form, query_string=query)
+            rv.get_data()
+            rv.close()
+            times.append(_clock() - start)
+
+        times.sort()
+        print('%-50s %7d %10.1f %10.1f %10.1f' % (
+            name, rv.status_code, n / sum(times),
+            percentile(times, 0.5) * 1e6, percentile(times, 0.99) * 1e6))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
+'''
+
+
+# code emitted once, before the views, when any resource has a concurrency
+# limit. Requests that can't get a slot in time are shed with a 503.
+POOL_CODE = '''
+import math
+import threading
+
+from flask import Response
+
+try:
+    from time import perf_counter as _clock
+except ImportError:
+    from time import time as _clock
+
+
+class ConcurrencyPool(object):
+    """
+    Bounds the number of requests waiting on internal_call at the same time
+    """
+
+    def __init__(self, limit, wait):
+        self.limit = limit
+        self.wait = wait
+        self.active = 0
+        self.retry_after = str(max(1, int(math.ceil(wait))))
+        self.cond = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        with self.cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+
+            deadline = _clock() + self.wait
+            while self.active >= self.limit:
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+    def shed(self):
+        return Response('Service Unavailable\\n', 503,
+                        {'Retry-After': self.retry_after})
+'''
 
 
 class Resource:
@@ -24,6 +368,18 @@ class Resource:
         self.doc = []
         self.name = "nonamed"
         self.group = "none"
+        # concurrency limit, seconds to wait for a slot and the pool name
+        self.concurrency = None
+        self.wait = None
+        self.pool = None
+        # (limit, wait) set for the whole group in the resource's file
+        self.group_limit = None
+        self.cache_control = None
+        # None, or the format of a streamed list: ndjson or json
+        self.stream = None
+        self.source = ""
+        # spec mistakes found while parsing, reported by main
+        self.errors = []
 
     def parse_something(self, lines, i, container):
         i = i + 1
@@ -58,7 +414,26 @@ class Resource:
     def __str__(self):
         return "%s: %s - %s" % (self.name, self.method, self.path)
 
-    def to_code(self):
+    def to_bench(self):
+        '''
+        Returns the benchmark ROUTES entry, a valid request for this view
+        '''
+        url = URL_PARAMS.sub('1', self.path)
+        args = dict((p, 'x') for p in self.params + self.optional)
+        query = dict((p, 'x') for p in self.filters)
+        if self.stream:
+            query['limit'] = '10'
+
+        if self.method in ['POST', 'PUT']:
+            form = args
+        else:
+            form = {}
+            query.update(args)
+
+        return "(%r, %r, %r, %r, %r)," % (unify(self.group) + '_' + self.name,
+                                          self.method, url, form, query)
+
+    def to_code(self, metrics=False, etag=False):
         args = URL_PARAMS.findall(self.path)
         req = 'request.form' if self.method in ['POST', 'PUT'] else 'request.args'
 
@@ -80,16 +455,32 @@ class Resource:
     data.update(dict((p, %(req)s.get(p)) for p in optional))
 ''' % { 'opt': ', '.join(repr(i) for i in self.optional), 'req': req, }
 
-        if self.filters:
+        filter_list = list(self.filters)
+        if self.stream:
+            # standard pagination filters for streamed lists
+            filter_list += [f for f in ['limit', 'cursor'] if f not in filter_list]
+
+        if filter_list:
             filters = '''
     filters = [%(filters)s]
     filters = dict((p, request.args.get(p)) for p in filters)
-''' % { 'filters': ', '.join(repr(i) for i in self.filters), 'req': req, }
+''' % { 'filters': ', '.join(repr(i) for i in filter_list), 'req': req, }
+
+        if self.stream:
+            filters += '''
+    if filters['limit'] is not None and not filters['limit'].isdigit():
+        raise abort(400)
+'''
+
+        name = unify(self.group) + '_' + self.name
+        decorators = ""
+        if metrics:
+            decorators = "@metered('%s')\n" % name
 
         code = '''
 
 @app.route('%(path)s', methods=['%(method)s'])
-def %(name)s(%(args)s):
+%(decorators)sdef %(name)s(%(args)s):
     """
 %(doc)s
     """
@@ -99,7 +490,8 @@ def %(name)s(%(args)s):
 ''' % {
             'path': self.path,
             'method': self.method,
-            'name': unify(self.group) + '_' + self.name,
+            'name': name,
+            'decorators': decorators,
             'args': ', '.join(args),
             'doc': ''.join(self.doc),
         }
@@ -118,13 +510,83 @@ def %(name)s(%(args)s):
         if args:
             realpath = "%s %% (%s, )" % (realpath, ', '.join(args))
 
-        code += '''
-    return internal_call(%(path)s, '%(method)s',
-                         data=data, filters=filters)
+        if self.pool:
+            # with metrics, the wait for a slot is measured on its own
+            acquire = '''
+    if not _pool_%(pool)s.acquire():
+        return _pool_%(pool)s.shed()''' % { 'pool': self.pool }
+            if metrics:
+                acquire = '''
+    _metrics_local.queue_start = _clock()%s
+    _metrics_local.backend_start = _clock()''' % acquire
+        elif metrics:
+            code += '''
+    _metrics_local.backend_start = _clock()'''
+
+        conditional = etag and self.method == 'GET' and not self.stream
+        if self.stream:
+            ret = 'items = '
+        elif conditional:
+            ret = 'rv = '
+        else:
+            ret = 'return '
+
+        if self.pool and self.stream:
+            # the slot is held until the whole list has been sent
+            code += '''%(acquire)s
+    try:
+        %(ret)sinternal_call(%(path)s, '%(method)s',
+        %(pad)sdata=data, filters=filters)
+        rv = stream(items, '%(stream)s')
+    except Exception:
+        _pool_%(pool)s.release()
+        raise
+    rv.call_on_close(_pool_%(pool)s.release)
+    return rv
+''' % {
+            'acquire': acquire,
+            'pool': self.pool,
+            'ret': ret,
+            'pad': ' ' * (len(ret) + len('internal_call(')),
+            'path': realpath,
+            'method': self.method,
+            'stream': self.stream,
+          }
+        elif self.pool:
+            code += '''%(acquire)s
+    try:
+        %(ret)sinternal_call(%(path)s, '%(method)s',
+        %(pad)sdata=data, filters=filters)
+    finally:
+        _pool_%(pool)s.release()
+''' % {
+            'acquire': acquire,
+            'pool': self.pool,
+            'ret': ret,
+            'pad': ' ' * (len(ret) + len('internal_call(')),
+            'path': realpath,
+            'method': self.method,
+          }
+        else:
+            code += '''
+    %(ret)sinternal_call(%(path)s, '%(method)s',
+    %(pad)sdata=data, filters=filters)
 ''' % {
-        'path': realpath,
-        'method': self.method,
-      }
+            'ret': ret,
+            'pad': ' ' * (len(ret) + len('internal_call(')),
+            'path': realpath,
+            'method': self.method,
+          }
+
+        if conditional:
+            if metrics:
+                code += '''    _metrics_local.backend_end = _clock()
+'''
+            code += '''    return conditional(rv, %r)
+''' % self.cache_control
+        elif self.stream and not self.pool:
+            code += '''    return stream(items, '%s')
+''' % self.stream
 
         return code
 
@@ -135,6 +597,23 @@ def unify(name):
     return name
 
 
+def parse_concurrency(value):
+    '''
+    Parses the value of a concurrency line, returns the (limit, wait) tuple
+    and an error message, one of them None
+    '''
+    match = CONCURRENCY_VALUE.match(value)
+    if not match:
+        return None, "invalid concurrency limit %r, expected N or N wait S" % value.strip()
+
+    limit = int(match.group("limit"))
+    if limit < 1:
+        return None, "concurrency limit must be at least 1, not %d" % limit
+
+    wait = match.group("wait")
+    return (limit, float(wait) if wait else None), None
+
+
 def parse_resource(group, lines, i, match, container):
     resource_name = match.groups()[0]
     resource_name = unify(resource_name)
@@ -157,6 +636,29 @@ def parse_resource(group, lines, i, match, container):
         if match:
             r.admin = True
 
+        # concurrency limit
+        match = CONCURRENCY.match(line)
+        if match:
+            limit, error = parse_concurrency(match.group("value"))
+            if error:
+                r.errors.append(error)
+            else:
+                r.concurrency, r.wait = limit
+                r.pool = unify(group) + '_' + r.name
+
+        # streamed list
+        match = STREAM.match(line)
+        if match:
+            r.stream = (match.group("format") or "ndjson").lower()
+            if r.stream not in STREAM_FORMATS:
+                r.errors.append("unknown stream format %r, expected one of %s" % (
+                    r.stream, ', '.join(STREAM_FORMATS)))
+
+        # cache control header for conditional GETs
+        match = CACHE_CONTROL.match(line)
+        if match:
+            r.cache_control = match.group("value").strip()
+
         # method and path
         match = HTTP.match(line)
         if match:
@@ -182,14 +684,24 @@ def parse_resource(group, lines, i, match, container):
 
         i += 1
 
+    if r.stream and r.method != 'GET':
+        r.errors.append("only GET resources can be streamed, not %s" % r.method)
+
     container.append(r)
     return i
 
 
 def load_resources(filename):
+    '''
+    Parses a file, returns its resources and the errors in its group lines,
+    as (description, filename, message) tuples
+    '''
     resources = []
+    errors = []
     with open(filename) as f:
         group = ""
+        # group concurrency limit, shared by the resources without their own
+        group_limit = None
 
         lines = f.readlines()
         i = 0
@@ -198,20 +710,185 @@ def load_resources(filename):
             match = H4.match(line)
             if match:
                 i = parse_resource(group, lines, i, match, resources)
+                r = resources[-1]
+                r.source = filename
+                r.group_limit = group_limit
                 continue
 
             match = H3.match(line)
             if match:
                 group = match.groups()[0]
                 group = group.strip()
+                group_limit = None
+
+            match = CONCURRENCY.match(line)
+            if match:
+                group_limit, error = parse_concurrency(match.group("value"))
+                if error:
+                    errors.append(("group %s" % group, filename, error))
 
             i += 1
 
-    return resources
+    return resources, errors
+
+
+def list_specs(paths):
+    '''
+    Expands the directories in paths to the spec files they contain, sorted
+    by name. Files given explicitly are always parsed
+    '''
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += sorted(os.path.join(path, f) for f in os.listdir(path)
+                                if not f.startswith('.') and
+                                f.endswith(SPEC_EXTENSIONS) and
+                                os.path.isfile(os.path.join(path, f)))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def load_all_resources(filenames, jobs=None):
+    '''
+    Parses every file, in a process pool when there are several, and merges
+    the resources keeping each group together, in order of first appearance.
+    Returns the resources and the errors of the group lines
+    '''
+    if len(filenames) > 1 and jobs != 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            parsed = pool.map(load_resources, filenames)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = [load_resources(f) for f in filenames]
+
+    resources = []
+    errors = []
+    groups = {}
+    for rs, file_errors in parsed:
+        errors += file_errors
+        for r in rs:
+            groups.setdefault(r.group, len(groups))
+            resources.append(r)
+
+    resources.sort(key=lambda r: groups[r.group])
+    return resources, errors
+
+
+def find_collisions(resources):
+    '''
+    Returns the pairs of resources from different files that would register
+    the same route or the same view name. Routes only differing in the names
+    of their URL parameters are the same route
+    '''
+    collisions = []
+    seen = {}
+    for r in resources:
+        name = unify(r.group) + '_' + r.name
+        for key in [(r.method, URL_PARAMS.sub('<>', r.path)), name]:
+            other = seen.setdefault(key, r)
+            if other.source != r.source and (other, r) not in collisions:
+                collisions.append((other, r))
+    return collisions
+
+
+def find_limit_conflicts(resources):
+    '''
+    Returns a resource for each pair of files setting different concurrency
+    limits for the same group
+    '''
+    conflicts = []
+    keys = []
+    seen = {}
+    for r in resources:
+        if r.group_limit is None:
+            continue
+        other = seen.setdefault(r.group, r)
+        key = (r.group, other.source, r.source)
+        if other.group_limit != r.group_limit and key not in keys:
+            keys.append(key)
+            conflicts.append((other, r))
+    return conflicts
+
+
+def format_limit(limit):
+    '''
+    Returns a (limit, wait) tuple the way it's written in the spec
+    '''
+    concurrency, wait = limit
+    if wait is None:
+        return "limit %d" % concurrency
+    return "limit %d wait %g" % (concurrency, wait)
+
+
+def assign_pools(resources):
+    '''
+    Gives the resources without their own limit the limit of their group, set
+    in any of the files. Admin only resources get pools of their own
+    '''
+    group_limits = {}
+    for r in resources:
+        if r.group_limit is not None:
+            group_limits.setdefault(r.group, r.group_limit)
+
+    for r in resources:
+        if r.pool is None and r.group in group_limits:
+            r.concurrency, r.wait = group_limits[r.group]
+            r.pool = unify(r.group)
+        if r.pool and r.admin:
+            r.pool = 'admin_' + r.pool
+
+
+def main(filenames, metrics=False, admin=False, wait=1.0, etag=False, jobs=None,
+         bench=False):
+    resources, errors = load_all_resources(list_specs(filenames), jobs)
+
+    errors += [(str(r), r.source, e) for r in resources for e in r.errors]
+    if errors:
+        for what, source, e in errors:
+            sys.stderr.write("error: %s (%s): %s\n" % (what, source, e))
+        sys.exit(1)
 
+    collisions = find_collisions([r for r in resources if admin or not r.admin])
+    if collisions:
+        for a, b in collisions:
+            sys.stderr.write("collision: %s (%s) and %s (%s)\n" % (a, a.source, b, b.source))
+        sys.exit(1)
 
-def main(filename):
-    resources = load_resources(filename)
+    conflicts = find_limit_conflicts(resources)
+    if conflicts:
+        for a, b in conflicts:
+            sys.stderr.write("conflicting concurrency limits for group %s: %s (%s) and %s (%s)\n" % (
+                a.group, format_limit(a.group_limit), a.source,
+                format_limit(b.group_limit), b.source))
+        sys.exit(1)
+
+    assign_pools(resources)
+
+    if bench:
+        print BENCH_HEADER
+
+    if metrics:
+        print METRICS_CODE
+
+    if etag:
+        print CONDITIONAL_CODE
+
+    if [r for r in resources if r.stream and (admin or not r.admin)]:
+        print STREAM_CODE
+
+    pools = []
+    for r in resources:
+        if r.pool and (admin or not r.admin) and r.pool not in [p.pool for p in pools]:
+            pools.append(r)
+    if pools:
+        print POOL_CODE
+        for r in pools:
+            print "_pool_%s = ConcurrencyPool(%d, %r)" % (
+                r.pool, r.concurrency, r.wait if r.wait is not None else wait)
 
     prevgroup = ""
     for r in resources:
@@ -219,10 +896,18 @@ def main(filename):
             prevgroup = r.group
             print "# %s" % r.group.upper()
 
-        if r.admin:
+        if r.admin and not admin:
             continue
 
-        print "%s" % r.to_code()
+        print "%s" % r.to_code(metrics=metrics, etag=etag)
+
+    if bench:
+        print "\nROUTES = ["
+        for r in resources:
+            if admin or not r.admin:
+                print "    %s" % r.to_bench()
+        print "]"
+        print BENCH_CODE
 
     # resources to unify
     while resources:
@@ -243,13 +928,30 @@ def main(filename):
                 print "# %s" % n
 
 
-def help():
-    print "usage:"
-    print "%s <filename>" % sys.argv[0]
-    sys.exit(0)
-
-
 if __name__ == '__main__':
-    if (len(sys.argv) != 2):
-        help()
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Parses a wiki API description and generates flask views.')
+    parser.add_argument('filenames', metavar='filename', type=str, nargs='+',
+                        help='The wiki API description files, or directories of them')
+    parser.add_argument('--metrics', dest='metrics',
+                        action='store_true',
+                        help='Instruments every view and adds a /metrics endpoint')
+    parser.add_argument('--admin', dest='admin',
+                        action='store_true',
+                        help='Also generates the admin only resources')
+    parser.add_argument('--wait', dest='wait',
+                        action='store', type=float, default=1.0,
+                        help='Seconds a request waits for a concurrency slot before a 503')
+    parser.add_argument('--etag', dest='etag',
+                        action='store_true',
+                        help='Adds ETags and conditional responses to GET views')
+    parser.add_argument('--jobs', '-j', dest='jobs',
+                        action='store', type=int, default=None,
+                        help='Number of processes parsing files, the number of cpus by default')
+    parser.add_argument('--bench', dest='bench',
+                        action='store_true',
+                        help='Generates a standalone module benchmarking every view')
+
+    args = parser.parse_args()
+
+    main(args.filenames, args.metrics, args.admin, args.wait, args.etag, args.jobs,
+         args.bench)
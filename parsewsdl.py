@@ -14,6 +14,122 @@ RESERVED_KEYWORDS=["return", "for", "lambda", "def", "if", "else", "while",
     "in", "not", "class", "global", "print", "yield", "is", "from", "import",
     "format", "type"]
 
+# runtime emitted before the models with --json. The schemas are built once
+# at import time, with the patterns compiled, so a request is validated by
+# walking a few python lists
+JSON_MODELS_HEADER = '''
+import re
+
+try:
+    string_types = basestring
+    integer_types = (int, long)
+except NameError:
+    string_types = str
+    integer_types = (int, )
+
+
+class ValidationError(ValueError):
+    def __init__(self, path, message):
+        ValueError.__init__(self, '%s: %s' % (path, message))
+        self.path = path
+
+
+class Primitive(object):
+    def __init__(self, name, check):
+        self.name = name
+        self.check = check
+
+    def validate(self, value, path):
+        if not self.check(value):
+            raise ValidationError(path, 'expected %s' % self.name)
+        return value
+
+
+DATETIME = re.compile(r'\\d{4}-\\d\\d-\\d\\dT\\d\\d:\\d\\d:\\d\\d(\\.\\d+)?(Z|[+-]\\d\\d:\\d\\d)?$')
+
+String = Primitive('string', lambda v: isinstance(v, string_types))
+Boolean = Primitive('boolean', lambda v: isinstance(v, bool))
+Integer = Long = Primitive('integer', lambda v: isinstance(v, integer_types) and not isinstance(v, bool))
+Float = Double = Primitive('number', lambda v: isinstance(v, integer_types + (float, )) and not isinstance(v, bool))
+DateTime = Primitive('dateTime', lambda v: isinstance(v, string_types) and DATETIME.match(v) is not None)
+Any = Primitive('anything', lambda v: True)
+
+
+class Field(object):
+    def __init__(self, name, type, min_occurs=0, max_occurs=1, pattern=None, fixed=None):
+        self.name = name
+        self.type = type
+        self.min_occurs = min_occurs
+        # None means unbounded
+        self.max_occurs = max_occurs
+        self.many = max_occurs is None or max_occurs > 1 or min_occurs > 1
+        self.pattern = re.compile('(?:%s)$' % pattern) if pattern else None
+        self.fixed = fixed
+
+    def validate_one(self, value, path):
+        self.type.validate(value, path)
+        if self.pattern is not None and not self.pattern.match(value):
+            raise ValidationError(path, 'does not match %s' % self.pattern.pattern)
+        if self.fixed is not None and value != self.fixed:
+            raise ValidationError(path, 'must be %r' % self.fixed)
+
+    def validate(self, obj, path):
+        path = path + '.' + self.name
+        value = obj.get(self.name)
+        if value is None:
+            if self.min_occurs > 0:
+                raise ValidationError(path, 'is required')
+            return
+
+        if not self.many:
+            self.validate_one(value, path)
+            return
+
+        if not isinstance(value, list):
+            raise ValidationError(path, 'expected a list')
+        if len(value) < self.min_occurs:
+            raise ValidationError(path, 'expected at least %d items' % self.min_occurs)
+        if self.max_occurs is not None and len(value) > self.max_occurs:
+            raise ValidationError(path, 'expected at most %d items' % self.max_occurs)
+        for i, v in enumerate(value):
+            self.validate_one(v, '%s[%d]' % (path, i))
+
+
+class Model(object):
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.names = frozenset(f.name for f in fields)
+
+    def validate(self, obj, path):
+        if not isinstance(obj, dict):
+            raise ValidationError(path, 'expected an object')
+        for field in self.fields:
+            field.validate(obj, path)
+        for key in obj:
+            if key not in self.names:
+                raise ValidationError(path + '.' + key, 'unknown field')
+        return obj
+
+
+Empty = Model('EmptyElementType', [])
+
+'''
+
+
+# xs primitive types and their spyne/json schema counterparts
+PRIMITIVE_TYPES = {
+    'xs:string': 'String',
+    'xs:boolean': 'Boolean',
+    'xs:int': 'Integer',
+    'xs:integer': 'Integer',
+    'xs:long': 'Long',
+    'xs:float': 'Float',
+    'xs:double': 'Double',
+    'xs:dateTime': 'DateTime',
+}
+
+
 def toposort(objs, get_dependencies=lambda objs, i: objs[i],
         is_equal=lambda a,b: a==b,
         list_objs=lambda objs: objs.keys()):
@@ -131,6 +247,22 @@ class Element(object):
             self.is_reserved_name = True
             self.name += "_"
 
+        # parsed first, empty types return early but keep their bounds
+        if "minOccurs" in element.attrib:
+            self.minOccurs = element.attrib["minOccurs"]
+            if self.minOccurs == "unbounded":
+                self.is_set = True
+                self.minOccurs = '"unbounded"'
+            else:
+                if int(self.minOccurs) > 1:
+                    self.is_set = True
+
+        if "maxOccurs" in element.attrib:
+            self.is_set = True
+            self.maxOccurs = element.attrib["maxOccurs"]
+            if self.maxOccurs == "unbounded":
+                self.maxOccurs = '"unbounded"'
+
         if self.elType.startswith("tns:"):
             self.elType = self.elType.split(':')[1]
 
@@ -147,40 +279,14 @@ class Element(object):
                     namespaces=ns)[0]
                 models.append(TypeModel(new_type, self.elType))
 
-        if "minOccurs" in element.attrib:
-            self.minOccurs = element.attrib["minOccurs"]
-            if self.minOccurs == "unbounded":
-                self.is_set = True
-                self.minOccurs = '"unbounded"'
-            else:
-                if int(self.minOccurs) > 1:
-                    self.is_set = True
-
-        if "maxOccurs" in element.attrib:
-            self.is_set = True
-            self.maxOccurs = element.attrib["maxOccurs"]
-            if self.maxOccurs == "unbounded":
-                self.maxOccurs = '"unbounded"'
-
     def elem_type(self):
         '''
         Returns the type class
         '''
 
-        mapping = {
-            'xs:string': 'String',
-            'xs:boolean': 'Boolean',
-            'xs:int': 'Integer',
-            'xs:integer': 'Integer',
-            'xs:long': 'Long',
-            'xs:float': 'Float',
-            'xs:double': 'Double',
-            'xs:dateTime': 'DateTime',
-        }
-
         ret = ""
         if not self.is_complex_type:
-            ret = mapping.get(self.elType, '')
+            ret = PRIMITIVE_TYPES.get(self.elType, '')
             if not ret:
                 print "TODO: unknown %s primitive type" % self.elType
         else:
@@ -241,6 +347,36 @@ class Element(object):
             return "%(class_name)s._type_info['%(name)s'] = %(type_str)s" %\
                 dict(class_name=self.parent.name, name=self.name[:-1], type_str=type_str)
 
+    def to_json_code(self):
+        '''
+        Generates the json schema field
+        '''
+        if self.is_empty_type:
+            type_str = "Empty"
+        elif self.is_complex_type:
+            type_str = self.elType
+        else:
+            type_str = PRIMITIVE_TYPES.get(self.elType, '')
+            if not type_str:
+                sys.stderr.write("TODO: unknown %s primitive type, using Any\n" % self.elType)
+                type_str = "Any"
+
+        params = [repr(self.get_real_name()), type_str]
+
+        if self.minOccurs:
+            min_occurs = self.minOccurs
+            if min_occurs == '"unbounded"':
+                min_occurs = "0"
+            params.append("min_occurs=" + min_occurs)
+
+        if self.maxOccurs:
+            max_occurs = self.maxOccurs
+            if max_occurs == '"unbounded"':
+                max_occurs = "None"
+            params.append("max_occurs=" + max_occurs)
+
+        return "Field(%s)," % ", ".join(params)
+
 
 class Group(object):
     '''
@@ -271,6 +407,12 @@ class Group(object):
         '''
         return 'Attribute = String(pattern="(%s)")' % '|'.join(self.values)
 
+    def to_json_code(self):
+        '''
+        Generates the json schema field
+        '''
+        return "Field('Attribute', String, pattern=%r)," % ('(%s)' % '|'.join(self.values))
+
 
 class Attribute(object):
     '''
@@ -294,6 +436,12 @@ class Attribute(object):
         return '%(name)s = String(pattern="%(fixed_value)s", min_occurs=1, nillable=False)' % dict(
             name=self.name, fixed_value=self.fixed_value)
 
+    def to_json_code(self):
+        '''
+        Generates the json schema field
+        '''
+        return "Field(%r, String, min_occurs=1, fixed=%r)," % (self.name, self.fixed_value)
+
 
 class TypeModel(object):
     '''
@@ -375,6 +523,17 @@ class TypeModel(object):
 
         return ret
 
+    def to_json_code(self):
+        '''
+        Generates the json schema
+        '''
+        ret = "%s = Model(%r, [\n" % (self.name, self.name)
+        for e in self.elements:
+            ret += "    %s\n" % e.to_json_code()
+        ret += "])\n"
+
+        return ret
+
     def __str__(self):
         '''
         returns the name of the model
@@ -442,8 +601,29 @@ class Operation(object):
 
         return tmpl
 
+    def to_json_code(self):
+        '''
+        Convert operation to a flask json view
+        '''
+
+        for model_name in [self.requestType, self.responseType]:
+            if not [i for i in models if i.name == model_name]:
+                return "# %s NOT IMPLEMENTED (because can't find %s)" % (self.name, model_name)
+
+        template = '''
+@app.route('/{name}', methods=['POST'])
+def {name}():
+    req = {request}.validate(request.get_json(force=True, silent=True), 'request')
+    resp = internal_call('{name}', req)
+    return jsonify({response}.validate(resp, 'response'))
+'''
+        return template.format(name=self.name,
+            request=self.requestType,
+            response=self.responseType)
+
 
-def main(filename, show_operations=True, show_models=True, filter_regexp=""):
+def main(filename, show_operations=True, show_models=True, filter_regexp="",
+         json=False):
     '''
     Main function, parses the input file and generates the output code in stdout
     '''
@@ -497,6 +677,31 @@ def main(filename, show_operations=True, show_models=True, filter_regexp=""):
         print "filter_regexp = ", filter_regexp
         rx = re.compile(filter_regexp)
 
+    if json:
+        if show_models:
+            print JSON_MODELS_HEADER
+
+            for model in models:
+                if not rx or rx.match(model.name):
+                    print model.to_json_code()
+
+        if show_operations:
+            print '''
+from flask import request, jsonify
+from models import * # file containing the models
+
+
+@app.errorhandler(ValidationError)
+def validation_error(e):
+    status = 500 if e.path.startswith('response') else 400
+    return jsonify(error=str(e)), status
+'''
+
+            for operation in operationObjs:
+                if not rx or rx.match(operation.name):
+                    print operation.to_json_code()
+        return
+
     if show_models:
         print '''
 from spyne.model.complex import ComplexModel, Array
@@ -546,7 +751,11 @@ if __name__ == '__main__':
     parser.add_argument('--filter', '-f', dest='filter_regexp',
                         action='store', default="",
                         help='filter names by reg exp')
+    parser.add_argument('--json', dest='json',
+                        action='store_true',
+                        help='Generates flask json views instead of spyne code')
 
     args = parser.parse_args()
 
-    main(args.filename, args.show_operations, args.show_models, args.filter_regexp)
+    main(args.filename, args.show_operations, args.show_models, args.filter_regexp,
+         args.json)